@@ -6,6 +6,7 @@ Import and use these functions in your API endpoints for database operations.
 """
 
 from pymongo import MongoClient
+import redis
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -17,14 +18,29 @@ load_dotenv()
 
 _client = None
 db = None
+cache = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # Explicit pool sizing: keep warm sockets around and fail fast instead of
+    # queueing indefinitely when the pool is exhausted under load
+    _client = MongoClient(
+        database_url,
+        maxPoolSize=100,
+        minPoolSize=10,
+        waitQueueTimeoutMS=1000,
+    )
     db = _client[database_name]
 
+# Optional Redis cache in front of MongoDB. Short timeouts so a slow or
+# unreachable Redis degrades to plain database reads instead of stalling.
+redis_url = os.getenv("REDIS_URL")
+
+if redis_url:
+    cache = redis.Redis.from_url(redis_url, socket_timeout=0.25, socket_connect_timeout=0.25)
+
 # Helper functions for common database operations
 def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
@@ -0,0 +1,33 @@
+"""
+Request Hot-Path Helpers
+
+Small, fully typed helpers called on every authenticated request. They only
+use the standard library so the module can be compiled ahead of time with
+mypyc (start_server.sh with MYPYC=1). A compiled fastpath.*.so takes
+precedence over this file when both exist, and edits here are not picked up
+(not even by --reload) until start_server.sh rebuilds or removes it.
+"""
+
+import base64
+import hashlib
+from typing import Optional
+
+_BEARER_PREFIXES = ("Bearer ", "bearer ")
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    """Return the token from an Authorization header, or None if it isn't a bearer header"""
+    # Slice-compare the scheme rather than lowercasing the whole header
+    if not authorization or authorization[:7] not in _BEARER_PREFIXES:
+        return None
+    return authorization[7:]
+
+
+def token_cache_key(token: str) -> bytes:
+    """Fixed-size cache key for a raw token"""
+    return hashlib.sha256(token.encode()).digest()
+
+
+def b64url(raw: bytes) -> bytes:
+    """Unpadded base64url, as used in JWT segments"""
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
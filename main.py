@@ -1,22 +1,47 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
 import os
-from datetime import datetime, timedelta, timezone
-from typing import Optional, List
-
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Annotated, Optional, List
+
+from cachetools import TLRUCache
 from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from jose import jwt, JWTError
-from passlib.context import CryptContext
-
-from database import db, create_document, get_documents
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import AfterValidator, BaseModel, ConfigDict, EmailStr, ValidationError
+import jwt
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from redis.exceptions import RedisError
+from email_validator import EmailNotValidError, validate_email
+
+from database import db, cache, create_document, get_documents
+from fastpath import b64url, bearer_token, token_cache_key
+from passwords import hash_password, password_needs_rehash, verify_password
 from schemas import DemoRequest
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Comma-separated list of allowed origins, e.g. "https://app.example.com".
+# Unset falls back to "*" for local development; a wildcard cannot be combined
+# with credentials, so credentials are only allowed for explicit origins.
+CORS_ORIGINS = frozenset(o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip())
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=sorted(CORS_ORIGINS) or ["*"],
+    allow_credentials=bool(CORS_ORIGINS),
     allow_methods=["*"],
     allow_headers=["*"],
 )
@@ -28,45 +53,134 @@ ALGORITHM = "HS256"
 SECRET_KEY = os.getenv("AUTH_SECRET", "dev-secret-change-me")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Verified against when login gets an unknown email; see login(). It matches
+# argon2id timing only: accounts still on a legacy bcrypt hash (cost 10-12)
+# answer noticeably slower until their next login migrates them, so those
+# dormant accounts remain distinguishable by latency during the migration.
+_DUMMY_HASH = hash_password("dummy-do-not-use")
+
+
+# Password hashing is CPU-bound; run it in worker processes so hashes use
+# every core instead of competing with requests in the default threadpool.
+# Workers are started lazily, after pymongo and the threadpool already have
+# threads running, so they must not be plain forks of this process. The
+# forkserver preloads only the side-effect-free passwords module. (Workers do
+# re-import the launching script, which is cheap for `uvicorn main:app` but
+# means `python main.py` runs this module's import-time setup in each worker.)
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _pool_context = multiprocessing.get_context("forkserver")
+    _pool_context.set_forkserver_preload(["passwords"])
+else:
+    _pool_context = multiprocessing.get_context("spawn")
+password_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=_pool_context)
+
+
+async def a_hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_pool, hash_password, password)
+
+
+# Successful verifications, keyed by HMAC(secret, password|hash) so the cache
+# holds nothing useful to someone who can read process memory. Entries expire
+# after VERIFY_CACHE_TTL seconds; the oldest are evicted past VERIFY_CACHE_SIZE.
+VERIFY_CACHE_SIZE = 4096
+VERIFY_CACHE_TTL = 300
+_verified: "OrderedDict[bytes, float]" = OrderedDict()
+
+
+def _verify_cache_key(plain: str, hashed: str) -> bytes:
+    return hmac.new(SECRET_KEY.encode(), plain.encode() + b"|" + hashed.encode(), hashlib.sha256).digest()
+
+
+async def a_verify_password(plain: str, hashed: str) -> bool:
+    key = _verify_cache_key(plain, hashed)
+    expires_at = _verified.get(key)
+    if expires_at is not None:
+        if expires_at > time.monotonic():
+            _verified.move_to_end(key)
+            return True
+        del _verified[key]
+
+    loop = asyncio.get_running_loop()
+    ok = await loop.run_in_executor(password_pool, verify_password, plain, hashed)
+    if ok:
+        _verified[key] = time.monotonic() + VERIFY_CACHE_TTL
+        if len(_verified) > VERIFY_CACHE_SIZE:
+            _verified.popitem(last=False)
+    return ok
+
+
+# Tokens are always HS256 with the same key, so the encoded header and the
+# keyed HMAC state are built once; encoding only hashes the payload.
+_JWT_HEADER_SEGMENT = b64url(json.dumps({"alg": ALGORITHM, "typ": "JWT"}, separators=(",", ":")).encode())
+_JWT_SIGNER = hmac.new(SECRET_KEY.encode(), digestmod=hashlib.sha256)
+
+
+def create_access_token(data: dict, ttl: Optional[int] = None) -> str:
+    # exp is an epoch integer; no datetime/timedelta needed per token
+    if ttl is None:
+        ttl = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    to_encode = {**data, "exp": int(time.time()) + ttl}
+    payload = json.dumps(to_encode, separators=(",", ":")).encode()
+    signing_input = _JWT_HEADER_SEGMENT + b"." + b64url(payload)
+    signer = _JWT_SIGNER.copy()
+    signer.update(signing_input)
+    return (signing_input + b"." + b64url(signer.digest())).decode()
 
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+# ======================
+# Models
+# ======================
+# Fast path: dot-atom local part and LDH hostname labels (RFC 5321), ASCII only
+_ATOM = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+EMAIL_RE = re.compile(rf"{_ATOM}(?:\.{_ATOM})*@{_LABEL}(?:\.{_LABEL})*\.[A-Za-z]{{2,63}}")
 
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+def _email(v: str) -> str:
+    local, _, _ = v.partition("@")
+    if len(v) > 254 or len(local) > 64 or not EMAIL_RE.fullmatch(v):
+        # Not plain ASCII (internationalized local part, IDN or punycode
+        # domain) or invalid: defer to the full validator EmailStr uses
+        try:
+            v = validate_email(v, check_deliverability=False).normalized
+        except EmailNotValidError:
+            raise ValueError("value is not a valid email address")
+    # Lowercase so lookups against the unique email index are deterministic
+    return v.lower()
 
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+Email = Annotated[str, AfterValidator(_email)]
 
 
-# ======================
-# Models
-# ======================
 class RegisterBody(BaseModel):
-    email: EmailStr
+    model_config = ConfigDict(extra="forbid")
+
+    email: Email
     password: str
     name: Optional[str] = None
 
 
 class LoginBody(BaseModel):
-    email: EmailStr
+    model_config = ConfigDict(extra="forbid")
+
+    email: Email
     password: str
 
 
 class UserOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     id: str
-    email: EmailStr
+    # Built from stored documents and token claims, which may hold addresses
+    # accepted by earlier validation rules; don't reject them on the way out
+    email: str
     name: Optional[str] = None
 
 
 class TokenOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     access_token: str
     token_type: str = "bearer"
     user: UserOut
@@ -76,33 +190,131 @@ class TokenOut(BaseModel):
 # Helpers
 # ======================
 
+# Resolve collection handles once instead of on every request
+AUTHUSER = db["authuser"] if db is not None else None  # schema name lowercased
+
+
 def users_col():
-    if db is None:
+    if AUTHUSER is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    return db["authuser"]  # schema name lowercased
+    return AUTHUSER
+
+
+# Set once the unique email index is known to exist. Until then register checks
+# for an existing account itself instead of relying on DuplicateKeyError.
+email_index_ready = False
+
+
+@app.on_event("startup")
+def ensure_indexes():
+    # Unique email index: register relies on it to reject duplicates, and
+    # every email lookup becomes an index probe instead of a collection scan
+    global email_index_ready
+    if AUTHUSER is None:
+        return
+    try:
+        # Legacy mixed-case emails are lowercased by migrate.py, not here
+        AUTHUSER.create_index("email", unique=True)
+        email_index_ready = True
+    except PyMongoError as e:
+        # Keep serving (and let /test report the problem) if the database is
+        # unreachable or existing duplicate emails block the unique index
+        logger.error("Could not create authuser email index: %s", e)
 
 
 def serialize_user(doc) -> UserOut:
     return UserOut(id=str(doc.get("_id")), email=doc.get("email"), name=doc.get("name"))
 
 
+def user_claims(user: UserOut) -> dict:
+    # Everything get_current_user needs, so it can skip the database
+    return {"sub": user.email, "uid": user.id, "name": user.name}
+
+
+# Fields needed to build a UserOut; keeps password_hash off the wire
+USER_PROJECTION = {"_id": 1, "email": 1, "name": 1}
+
+
+# Lifetime of u:{email} entries in Redis
+REDIS_USER_TTL = 60
+
+
+def _user_cache_key(email: str) -> str:
+    return f"u:{email}"
+
+
+def lookup_user(email: str) -> UserOut:
+    # Tokens issued before emails were lowercased carry the original case
+    email = email.lower()
+    # Redis first when configured; any Redis failure falls through to Mongo
+    if cache is not None:
+        try:
+            cached = cache.get(_user_cache_key(email))
+        except RedisError:
+            cached = None
+        if cached is not None:
+            try:
+                return UserOut.model_validate_json(cached)
+            except ValidationError:
+                # Corrupt, or written under an older UserOut shape; refetch
+                pass
+
+    user_doc = users_col().find_one({"email": email}, projection=USER_PROJECTION)
+    if not user_doc:
+        raise HTTPException(status_code=401, detail="User not found")
+    user = serialize_user(user_doc)
+    if cache is not None:
+        try:
+            cache.setex(_user_cache_key(email), REDIS_USER_TTL, user.model_dump_json())
+        except RedisError:
+            pass
+    return user
+
+
+def forget_user(email: str) -> None:
+    # Call after writing to a user document so lookup_user doesn't serve it stale
+    if cache is not None:
+        try:
+            cache.delete(_user_cache_key(email))
+        except RedisError:
+            pass
+
+
+# Resolved users per token, stored as (user, exp). An entry lives for at most
+# 60s and never past the token's own expiry.
+USER_CACHE_TTL = 60
+_user_cache = TLRUCache(
+    maxsize=10_000,
+    ttu=lambda _key, value, now: min(now + USER_CACHE_TTL, value[1]),
+    timer=time.time,
+)
+_user_cache_lock = threading.Lock()
+
+
 def get_current_user(authorization: Optional[str] = Header(None)) -> UserOut:
-    if not authorization or not authorization.lower().startswith("bearer "):
+    token = bearer_token(authorization)
+    if token is None:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    token = authorization.split(" ", 1)[1]
+    cache_key = token_cache_key(token)
+    with _user_cache_lock:
+        cached = _user_cache.get(cache_key)
+    if cached is not None:
+        return cached[0]
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        sub = payload.get("sub")
-        if not sub:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except JWTError:
+        # exp is required: it bounds how long the user stays in _user_cache
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]})
+    except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    # Query by email stored in sub for simplicity
-    user_doc = users_col().find_one({"email": sub})
-    if not user_doc:
-        raise HTTPException(status_code=401, detail="User not found")
-    return serialize_user(user_doc)
+    if "uid" in payload:
+        user = UserOut(id=payload["uid"], email=payload["sub"], name=payload.get("name"))
+    else:
+        # Tokens issued before uid/name were embedded only carry the email
+        user = lookup_user(payload["sub"])
+    with _user_cache_lock:
+        _user_cache[cache_key] = (user, payload["exp"])
+    return user
 
 
 # ======================
@@ -118,6 +330,11 @@ def hello():
     return {"message": "Hello from the backend API!"}
 
 
+# Environment doesn't change at runtime; resolve the /test status lines once
+DATABASE_URL_STATUS = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+DATABASE_NAME_STATUS = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+
+
 @app.get("/test")
 def test_database():
     """Test endpoint to check if database is available and accessible"""
@@ -127,7 +344,8 @@ def test_database():
         "database_url": None,
         "database_name": None,
         "connection_status": "Not Connected",
-        "collections": []
+        "collections": [],
+        "email_index": None,
     }
 
     try:
@@ -136,6 +354,7 @@ def test_database():
             response["database_url"] = "✅ Configured"
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
+            response["email_index"] = "✅ Ready" if email_index_ready else "❌ Missing (see server log)"
             try:
                 collections = db.list_collection_names()
                 response["collections"] = collections[:10]
@@ -147,9 +366,8 @@ def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    import os as _os
-    response["database_url"] = "✅ Set" if _os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if _os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = DATABASE_URL_STATUS
+    response["database_name"] = DATABASE_NAME_STATUS
 
     return response
 
@@ -158,38 +376,72 @@ def test_database():
 # Auth endpoints
 # ======================
 @app.post("/auth/register", response_model=TokenOut)
-def register(body: RegisterBody):
+async def register(body: RegisterBody):
     col = users_col()
-    existing = col.find_one({"email": body.email})
-    if existing:
-        raise HTTPException(status_code=409, detail="Email already registered")
+    if not email_index_ready:
+        # Without the unique index, insert_one can't detect duplicates
+        existing = await run_in_threadpool(col.find_one, {"email": body.email}, {"_id": 1})
+        if existing:
+            raise HTTPException(status_code=409, detail="Email already registered")
+    password_hash = await a_hash_password(body.password)
+    now = datetime.now(timezone.utc)
     doc = {
         "email": body.email,
-        "password_hash": hash_password(body.password),
+        "password_hash": password_hash,
         "name": body.name,
-        "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc),
+        "created_at": now,
+        "updated_at": now,
         "is_active": True,
     }
-    col.insert_one(doc)
+    try:
+        await run_in_threadpool(col.insert_one, doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email already registered")
+    await run_in_threadpool(forget_user, body.email)
     user = serialize_user(doc)
-    token = create_access_token({"sub": user.email})
-    return TokenOut(access_token=token, user=user)
+    token = create_access_token(user_claims(user))
+    # user was just built and validated server-side; skip re-validating it
+    return TokenOut.model_construct(access_token=token, token_type="bearer", user=user)
 
 
 @app.post("/auth/login", response_model=TokenOut)
-def login(body: LoginBody):
+async def login(body: LoginBody):
     col = users_col()
-    user_doc = col.find_one({"email": body.email})
-    if not user_doc or not verify_password(body.password, user_doc.get("password_hash", "")):
+    user_doc = await run_in_threadpool(col.find_one, {"email": body.email})
+    if not user_doc:
+        # Spend the same hashing time as a real check so unknown emails can't be
+        # told apart (and hot accounts picked out) by response latency. Goes
+        # straight to the pool: a cached success here would make it fast.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(password_pool, verify_password, body.password, _DUMMY_HASH)
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    if not await a_verify_password(body.password, user_doc.get("password_hash", "")):
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    if password_needs_rehash(user_doc["password_hash"]):
+        # Stored hash is bcrypt or uses older argon2 parameters; upgrade it now that we have the plaintext
+        new_hash = await a_hash_password(body.password)
+        await run_in_threadpool(
+            col.update_one,
+            {"_id": user_doc["_id"]},
+            {"$set": {"password_hash": new_hash, "updated_at": datetime.now(timezone.utc)}},
+        )
+        await run_in_threadpool(forget_user, body.email)
     user = serialize_user(user_doc)
-    token = create_access_token({"sub": user.email})
-    return TokenOut(access_token=token, user=user)
+    token = create_access_token(user_claims(user))
+    # user was just built and validated server-side; skip re-validating it
+    return TokenOut.model_construct(access_token=token, token_type="bearer", user=user)
+
+
+@app.on_event("shutdown")
+def shutdown_password_pool():
+    password_pool.shutdown(wait=False, cancel_futures=True)
 
 
 @app.get("/auth/me", response_model=UserOut)
-def me(current_user: UserOut = Depends(get_current_user)):
+def me(full: bool = False, current_user: UserOut = Depends(get_current_user)):
+    # Token claims are a snapshot from login; full=true reads the stored profile
+    if full:
+        return lookup_user(current_user.email)
     return current_user
 
 
@@ -208,10 +460,13 @@ class DemoRequestOut(DemoRequestIn):
     id: str
 
 
+DEMOREQUEST = db["demorequest"] if db is not None else None
+
+
 def demo_col():
-    if db is None:
+    if DEMOREQUEST is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    return db["demorequest"]
+    return DEMOREQUEST
 
 
 def serialize_demo(doc) -> DemoRequestOut:
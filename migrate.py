@@ -0,0 +1,72 @@
+"""
+Database Migrations
+
+One-off data migrations, run before the server starts (start_server.sh does
+this). Each migration claims a document in the "migrations" collection before
+running, so it runs exactly once even if several processes start together.
+
+Usage: python migrate.py
+"""
+
+import logging
+import sys
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+logger = logging.getLogger("migrate")
+
+
+def lowercase_emails(db) -> None:
+    """Lowercase authuser emails stored before emails were canonicalized"""
+    col = db["authuser"]
+    # The unique index makes each rename atomic: a case variant that collides
+    # with an address already taken fails with DuplicateKeyError instead of
+    # creating a duplicate, even with registrations running concurrently
+    col.create_index("email", unique=True)
+    # Oldest first: when accounts differ only in case, the one already stored
+    # lowercase keeps the address, otherwise the oldest does. The others are
+    # left untouched (they can't log in) and logged for manual merging.
+    for doc in col.find({}, projection={"_id": 1, "email": 1}).sort("created_at", 1):
+        email = doc.get("email")
+        if not email or email == email.lower():
+            continue
+        try:
+            col.update_one(
+                {"_id": doc["_id"]},
+                {"$set": {"email": email.lower(), "updated_at": datetime.now(timezone.utc)}},
+            )
+        except DuplicateKeyError:
+            logger.warning("Not lowercasing email of user %s: %s belongs to another account", doc["_id"], email.lower())
+
+
+MIGRATIONS = [
+    ("lowercase_emails", lowercase_emails),
+]
+
+
+def run(db) -> None:
+    applied = db["migrations"]
+    for name, migration in MIGRATIONS:
+        try:
+            applied.insert_one({"_id": name, "started_at": datetime.now(timezone.utc)})
+        except DuplicateKeyError:
+            continue  # already applied, or being applied by another process
+        logger.info("Applying migration %s", name)
+        try:
+            migration(db)
+        except Exception:
+            # Release the claim so the migration is retried on the next run
+            applied.delete_one({"_id": name})
+            raise
+        applied.update_one({"_id": name}, {"$set": {"finished_at": datetime.now(timezone.utc)}})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+    if db is None:
+        logger.error("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+        sys.exit(1)
+    run(db)
@@ -0,0 +1,51 @@
+"""
+Password Hashing
+
+argon2id hashing, with verification of legacy bcrypt hashes. These functions
+run inside main.password_pool's worker processes, so importing this module
+must stay cheap: no database/Redis connections and no hashing at import time.
+"""
+
+import os
+
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "19456"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "2"))
+
+password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
+
+
+def _is_bcrypt_hash(hashed: str) -> bool:
+    return hashed.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def hash_password(password: str) -> str:
+    return password_hasher.hash(password)
+
+
+def verify_password(plain: str, hashed: str) -> bool:
+    if _is_bcrypt_hash(hashed):
+        # Legacy hash from before the argon2id switch
+        try:
+            return bcrypt.checkpw(plain.encode(), hashed.encode())
+        except ValueError:
+            return False
+    try:
+        return password_hasher.verify(hashed, plain)
+    except (VerificationError, InvalidHashError):
+        # Wrong password, or a malformed/empty stored hash
+        return False
+
+
+def password_needs_rehash(hashed: str) -> bool:
+    # bcrypt hashes are migrated to argon2id; argon2 hashes whenever the cost
+    # parameters above change
+    return _is_bcrypt_hash(hashed) or password_hasher.check_needs_rehash(hashed)
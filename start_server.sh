@@ -14,6 +14,17 @@ fi
 mkdir -p logs
 echo "Installing dependencies..."
 pip install -r requirements.txt
+# Python imports a compiled fastpath.*.so ahead of fastpath.py, so remove any
+# earlier build first: it's either rebuilt below or must not shadow the source
+rm -f fastpath.*.so
+if [ "$MYPYC" = "1" ]; then
+  # Optional: compile the request hot-path helpers to a C extension
+  echo "Compiling fastpath.py with mypyc..."
+  pip install "mypy==1.7.1"
+  mypyc fastpath.py || echo "mypyc build failed, using pure-Python fastpath"
+fi
+echo "Applying database migrations..."
+python migrate.py || echo "Migrations not applied; see output above"
 echo "Starting FastAPI server..."
 nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
 echo "Server started in background"
@@ -0,0 +1,37 @@
+import jwt
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from main import ALGORITHM, SECRET_KEY, LoginBody, RegisterBody, UserOut, get_current_user, serialize_user
+
+
+@pytest.mark.parametrize(
+    "email",
+    ["a..b@example.com", ".a@example.com", "a@-ex.com", "a,b@ex.com", "a@ex_ample.com"],
+)
+def test_register_rejects_invalid_emails(email):
+    with pytest.raises(ValidationError):
+        RegisterBody(email=email, password="pw")
+
+
+@pytest.mark.parametrize("email", ["josé@example.com", "user@example.xn--p1ai", "ü@bücher.de"])
+def test_internationalized_emails_still_validate_and_serialize(email):
+    # Accepted by the EmailStr rule accounts were registered under
+    body = LoginBody(email=email, password="pw")
+    user = serialize_user({"_id": "1", "email": body.email})
+    assert user.email == body.email
+
+
+def test_register_email_is_lowercased():
+    body = RegisterBody(email="First.Last@Example.COM", password="pw")
+    assert body.email == "first.last@example.com"
+    assert UserOut(id="1", email=body.email).email == body.email
+
+
+@pytest.mark.parametrize("claims", [{"sub": "a@example.com"}, {"exp": 4102444800}])
+def test_token_missing_required_claim_is_rejected(claims):
+    token = jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+    with pytest.raises(HTTPException) as exc:
+        get_current_user(authorization="Bearer " + token)
+    assert exc.value.status_code == 401